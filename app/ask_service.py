@@ -3,7 +3,7 @@ ASK71 API client for streaming requests
 """
 from fastapi import HTTPException, status
 import httpx
-import json
+import orjson
 import logging
 import time
 from typing import Optional, Dict, Any, Tuple, AsyncGenerator
@@ -27,16 +27,38 @@ class ASK71Response:
 class ASK71Client:
     """Async client for interacting with ASK71 API with streaming support"""
     
-    def __init__(self, api_key: str, agent_id: str, api_url: str):
+    def __init__(
+        self,
+        api_key: str,
+        agent_id: str,
+        api_url: str,
+        http2: bool = True,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 50,
+        keepalive_expiry: float = 30.0,
+    ):
         self.api_key = api_key
         self.agent_id = agent_id
         self.api_url = api_url
+        self.conversations_url = f"{api_url.rstrip('/')}/v1/conversations/"
+        # Pool and protocol options live on the transport; AsyncClient
+        # ignores its own http2/limits arguments when a transport is given.
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            retries=1,
+        )
         self.client = httpx.AsyncClient(
             headers={
                 "x-api-key": api_key,
                 "Content-Type": "application/json"
             },
-            timeout=httpx.Timeout(600.0)
+            timeout=httpx.Timeout(600.0),
+            transport=transport,
         )
     
     async def close(self):
@@ -53,14 +75,15 @@ class ASK71Client:
     
     async def stream_events(
         self,
+        url: str,
         json_data: Dict[str, Any],
         timeout: Optional[int] = 6000,
-        path: Optional[str] = "",
     ) -> AsyncGenerator[Tuple[str, str], None]:
         """
         Stream Server-Sent Events from the ASK71 API.
         
         Args:
+            url: Fully resolved endpoint URL
             json_data: JSON payload for the request
             timeout: Request timeout in seconds
         
@@ -73,9 +96,8 @@ class ASK71Client:
         
         request_kwargs = {
             "method": "POST",
-            "url": f"{self.api_url.rstrip('/')}/{path.lstrip('/')}",
+            "url": url,
             "json": json_data,
-            "headers": self.client.headers,
         }
         
         if timeout:
@@ -92,24 +114,25 @@ class ASK71Client:
                 yield sse_event.event, sse_event.data
             
     
-    async def send_query(
-        self, 
-        query: str, 
+    async def stream_query(
+        self,
+        query: str,
         conversation_id: Optional[str] = None
-    ) -> ASK71Response:
+    ) -> AsyncGenerator[Tuple[str, Any], None]:
         """
-        Send a query to ASK71 and get the aggregated streaming response
+        Send a query to ASK71 and yield the response as it streams in
         
         Args:
             query: User's question or message
             conversation_id: Optional conversation ID to continue existing conversation
         
-        Returns:
-            ASK71Response object containing the response message and metadata
+        Yields:
+            Tuple[str, Any]: ("chunk", str) for each piece of the message text and
+            ("meta", dict) for conversation metadata events
         
         Raises:
             httpx.HTTPStatusError: If the request fails
-            ValueError: If the response format is invalid
+            HTTPException: If ASK71 reports an error event
         """
         payload = {
             "agent_id": self.agent_id,
@@ -124,43 +147,60 @@ class ASK71Client:
         logger.info(f"Sending query to ASK71: {query[:50]}...")
         
         try:
-            # Collect and aggregate stream events
-            complete_response = {}
-            message = []
-            
-            async for event, data in self.stream_events(payload, path="/v1/conversations/"):
+            async for event, data in self.stream_events(self.conversations_url, payload):
                 if event == "error":
-                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=json.loads(data))
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=orjson.loads(data))
                 if event in ("metadata", "conversation_created"):
-                    complete_response.update(json.loads(data))
+                    yield "meta", orjson.loads(data)
                     continue
                 
                 if event == "message":
-                    message.append(json.loads(data).get("data", ""))
-            
-            # Aggregate message chunks
-            complete_response["message"] = "".join(message)
-            
-            # Validate response structure
-            if not isinstance(complete_response, dict):
-                raise ValueError(f"Invalid response format: expected dict, got {type(complete_response)}")
-            
-            message_text = complete_response.get('message')
-            conv_id = complete_response.get('conversation_id') or conversation_id
-            msg_id = complete_response.get('message_id')
-            
-            logger.info(f"Received response from ASK71: conversation_id={conv_id}, message_id={msg_id}")
-            
-            return ASK71Response(
-                message=message_text,
-                conversation_id=conv_id,
-                message_id=msg_id
-            )
+                    yield "chunk", orjson.loads(data).get("data", "")
                 
         except httpx.HTTPStatusError as e:
             logger.error(f"Error sending query to ASK71: {e}")
             raise
-        except (json.JSONDecodeError, ValueError) as e:
+        except (orjson.JSONDecodeError, ValueError) as e:
             logger.error(f"Error parsing ASK71 response: {e}")
             raise
-
+    
+    async def send_query(
+        self, 
+        query: str, 
+        conversation_id: Optional[str] = None
+    ) -> ASK71Response:
+        """
+        Send a query to ASK71 and get the aggregated streaming response
+        
+        Args:
+            query: User's question or message
+            conversation_id: Optional conversation ID to continue existing conversation
+        
+        Returns:
+            ASK71Response object containing the response message and metadata
+        
+        Raises:
+            httpx.HTTPStatusError: If the request fails
+            ValueError: If the response format is invalid
+        """
+        # Collect and aggregate stream events
+        complete_response = {}
+        message = []
+        
+        async for kind, value in self.stream_query(query, conversation_id):
+            if kind == "meta":
+                complete_response.update(value)
+            else:
+                message.append(value)
+        
+        message_text = "".join(message)
+        conv_id = complete_response.get('conversation_id') or conversation_id
+        msg_id = complete_response.get('message_id')
+        
+        logger.info(f"Received response from ASK71: conversation_id={conv_id}, message_id={msg_id}")
+        
+        return ASK71Response(
+            message=message_text,
+            conversation_id=conv_id,
+            message_id=msg_id
+        )
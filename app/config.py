@@ -15,10 +15,18 @@ class Settings(BaseModel):
     whatsapp_app_id: str = Field(..., alias="WHATSAPP_APP_ID")
     whatsapp_app_secret: str = Field(..., alias="WHATSAPP_APP_SECRET")
     session_timeout: int = Field(default=60, alias="SESSION_TIMEOUT")
+    db_pool_size: int = Field(default=10, alias="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=20, alias="DB_MAX_OVERFLOW")
+    db_pool_timeout: float = Field(default=5, alias="DB_POOL_TIMEOUT")
+    db_pool_recycle: int = Field(default=1800, alias="DB_POOL_RECYCLE")
     ask_api_base: str = Field(
         default="https://api.ask.dev.ai71services.ai",
         alias="ASK_API_BASE",
     )
+    ask_http2: bool = Field(default=True, alias="ASK_HTTP2")
+    ask_max_connections: int = Field(default=100, alias="ASK_MAX_CONNECTIONS")
+    ask_max_keepalive_connections: int = Field(default=50, alias="ASK_MAX_KEEPALIVE_CONNECTIONS")
+    ask_keepalive_expiry: float = Field(default=30.0, alias="ASK_KEEPALIVE_EXPIRY")
 
     model_config = {
         "populate_by_name": True,
@@ -38,6 +46,10 @@ def get_settings() -> Settings:
         "WHATSAPP_APP_ID",
         "WHATSAPP_APP_SECRET",
         "SESSION_TIMEOUT",
+        "DB_POOL_SIZE",
+        "DB_MAX_OVERFLOW",
+        "DB_POOL_TIMEOUT",
+        "DB_POOL_RECYCLE",
     }}
     return Settings(**env)
 
@@ -18,14 +18,25 @@ class DatabaseSessionManager:
         self._engine: Optional[AsyncEngine] = None
         self._sessionmaker: Optional[async_sessionmaker[AsyncSession]] = None
 
-    def init(self, db_uri: str) -> None:
+    def init(
+        self,
+        db_uri: str,
+        pool_size: int = 10,
+        max_overflow: int = 20,
+        pool_timeout: float = 5,
+        pool_recycle: int = 1800,
+    ) -> None:
         if not db_uri.startswith("postgresql+asyncpg://"):
             raise NotImplementedError("Only PostgreSQL with asyncpg is supported")
         self._engine = create_async_engine(
             url=db_uri,
             pool_pre_ping=True,
-            # no size limit.
-            pool_size=0,
+            # Bounded pool: bursts wait up to pool_timeout for a connection
+            # instead of opening one per concurrent handler.
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
         )
         self._sessionmaker = async_sessionmaker(
             bind=self._engine,
@@ -0,0 +1,194 @@
+"""
+Persistence helpers for WhatsApp users
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+from typing import Any, NamedTuple
+
+from cachetools import TTLCache
+from sqlalchemy import false, select, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import db_manager
+from app.models import User
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class UserState(NamedTuple):
+    """Session state of a user as it was before the current message."""
+
+    conversation_id: str | None
+    last_interaction_ts: float | None
+    created: bool
+
+
+# Per-process cache of known users, refreshed on every submitted write. An entry
+# outlives the session timeout only if nothing was written, in which case
+# the session has expired anyway and a reload costs nothing extra.
+_user_cache: TTLCache[str, UserState] = TTLCache(
+    maxsize=10_000,
+    ttl=settings.session_timeout * 60,
+)
+
+
+async def get_or_create_user(
+    db: AsyncSession,
+    wa_id: str,
+    username: str | None,
+    now_ts: float,
+) -> UserState:
+    """
+    Load a user's session state, inserting the user on their first message.
+
+    Known users are served from an in-process cache. Otherwise the insert
+    and the lookup run as one statement: the insert is skipped on conflict,
+    and the lookup reads the snapshot taken before the insert, so exactly
+    one branch returns a row.
+
+    Args:
+        db: Database session; the caller commits when the user was created
+        wa_id: WhatsApp ID of the user
+        username: WhatsApp profile name of the user
+        now_ts: Interaction time stored for a newly created user, as a Unix timestamp
+
+    Returns:
+        UserState with the stored conversation and whether the row was created
+    """
+    cached = _user_cache.get(wa_id)
+    if cached is not None:
+        return cached
+
+    inserted = (
+        pg_insert(User)
+        .values(
+            wa_id=wa_id,
+            username=username,
+            conversation_id=None,
+            last_interaction=dt.datetime.fromtimestamp(now_ts, dt.timezone.utc),
+        )
+        .on_conflict_do_nothing(index_elements=[User.wa_id])
+        .returning(User.conversation_id, User.last_interaction, true().label("created"))
+        .cte("inserted")
+    )
+    stmt = select(inserted.c.conversation_id, inserted.c.last_interaction, inserted.c.created).union_all(
+        select(User.conversation_id, User.last_interaction, false()).where(User.wa_id == wa_id)
+    )
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        # A concurrent first message inserted the user after our snapshot
+        # was taken; a fresh statement sees the committed row.
+        row = (
+            await db.execute(
+                select(User.conversation_id, User.last_interaction, false()).where(User.wa_id == wa_id)
+            )
+        ).one()
+    conversation_id, last_interaction, created = row
+    state = UserState(
+        conversation_id,
+        last_interaction.timestamp() if last_interaction is not None else None,
+        created,
+    )
+    # A new user exists only once the caller commits; until then the next
+    # lookup goes to the database, which keeps a failed commit from being
+    # cached as a known user.
+    if not created:
+        _user_cache[wa_id] = state
+    return state
+
+
+class UserWriter:
+    """
+    Batches user updates and writes them from a background task.
+
+    Submitted updates go straight into the user cache, so the next message
+    from the same user sees them before they reach the database. The writer
+    waits up to flush_interval seconds to gather up to batch_size updates
+    and stores them with one multi-row upsert.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 0.1) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the background writer task."""
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Write everything submitted so far and stop the writer."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    def submit(
+        self,
+        wa_id: str,
+        *,
+        username: str | None,
+        conversation_id: str | None,
+        last_interaction_ts: float,
+    ) -> None:
+        """Queue a user's conversation and interaction time (a Unix timestamp) for writing."""
+        _user_cache[wa_id] = UserState(conversation_id, last_interaction_ts, created=False)
+        self._queue.put_nowait({
+            "wa_id": wa_id,
+            "username": username,
+            "conversation_id": conversation_id,
+            "last_interaction": last_interaction_ts,
+        })
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+
+    async def _write(self, batch: list[dict[str, Any]]) -> None:
+        # A row may only be touched once per upsert, so keep the latest update per user.
+        rows = [
+            {**row, "last_interaction": dt.datetime.fromtimestamp(row["last_interaction"], dt.timezone.utc)}
+            for row in {row["wa_id"]: row for row in batch}.values()
+        ]
+        stmt = pg_insert(User).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.wa_id],
+            set_={
+                "username": stmt.excluded.username,
+                "conversation_id": stmt.excluded.conversation_id,
+                "last_interaction": stmt.excluded.last_interaction,
+            },
+        )
+        try:
+            async with db_manager.session() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except Exception:
+            logger.exception(f"Failed to write {len(rows)} user updates")
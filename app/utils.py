@@ -3,12 +3,168 @@ from contextlib import suppress
 from functools import wraps
 import logging
 import re
+import time
 from contextlib import suppress
 
 from pywa_async.types import Message
 
 logger = logging.getLogger(__name__)
 
+# Longest text sent in one WhatsApp message, leaving headroom under the 4096 limit.
+WHATSAPP_MAX_MESSAGE_LENGTH = 4000
+
+# Replies faster than the grace period never show a typing indicator; slower
+# ones refresh it before WhatsApp hides it (after about 25 seconds).
+TYPING_INDICATOR_GRACE = 0.8
+TYPING_INDICATOR_INTERVAL = 25
+
+# Characters that can open a Markdown span; everything else is copied in runs.
+_MARKDOWN_CHAR_RE = re.compile(r'[*~`\[]')
+
+
+class _LineScanner:
+    """
+    Finds closing delimiters on one line of text.
+
+    The converter moves left to right, so the last result for each delimiter
+    is kept and reused while the search start has not passed it. Openers
+    without a close then cost one scan of the line in total instead of one
+    scan each.
+    """
+
+    __slots__ = ("text", "end", "_found")
+
+    def __init__(self, text: str, end: int) -> None:
+        self.text = text
+        self.end = end
+        # Delimiter -> (search start, first match at or after it, or self.end)
+        self._found: dict[str, tuple[int, int]] = {}
+
+    def find(self, sub: str, start: int, end: int) -> int:
+        """Returns the index of sub in text[start:end], or -1."""
+        found = self._found.get(sub)
+        if found is not None and found[0] <= start <= found[1]:
+            pos = found[1]
+        else:
+            pos = self.text.find(sub, start, self.end)
+            if pos == -1:
+                pos = self.end
+            self._found[sub] = (start, pos)
+        return pos if pos + len(sub) <= end else -1
+
+    def find_italic_close(self, start: int, end: int) -> int:
+        """
+        Returns the index of the * that closes an italic span, or -1.
+
+        A closing * is neither part of a ** nor preceded by whitespace, so
+        bold spans inside the italic text are skipped over.
+        """
+        # Stored under "*", which find() is never asked for.
+        found = self._found.get("*")
+        if found is not None and found[0] <= start <= found[1]:
+            pos = found[1]
+        else:
+            text = self.text
+            pos = text.find('*', start, self.end)
+            while pos != -1 and (
+                text[pos - 1] == '*' or text[pos - 1].isspace() or text.startswith('*', pos + 1, self.end)
+            ):
+                pos = text.find('*', pos + 1, self.end)
+            if pos == -1:
+                pos = self.end
+            self._found["*"] = (start, pos)
+        return pos if pos < end else -1
+
+
+def _convert_markdown(text: str, start: int, end: int, out: list[str], line: _LineScanner) -> None:
+    """
+    Appends the WhatsApp rendering of text[start:end] to out.
+
+    text[start:end] lies within a single line, so every span (link, bold,
+    italic, strikethrough, code) closes on the line it opens on; unmatched
+    delimiters are copied through unchanged.
+    """
+    i = start
+    while i < end:
+        match = _MARKDOWN_CHAR_RE.search(text, i, end)
+        if match is None:
+            out.append(text[i:end])
+            return
+        if match.start() > i:
+            out.append(text[i:match.start()])
+        i = match.start()
+        char = text[i]
+
+        if char == '*':
+            # Bold italic: ***text*** -> *_text_*
+            if text.startswith('***', i, end):
+                close = line.find('***', i + 3, end)
+                if close != -1:
+                    out.append('*_')
+                    _convert_markdown(text, i + 3, close, out, line)
+                    out.append('_*')
+                    i = close + 3
+                    continue
+            # Bold: **text** -> *text*; an unmatched ** stays as-is.
+            if text.startswith('*', i + 1, end):
+                close = line.find('**', i + 2, end)
+                if close != -1:
+                    out.append('*')
+                    _convert_markdown(text, i + 2, close, out, line)
+                    out.append('*')
+                    i = close + 2
+                    continue
+                out.append('**')
+                i += 2
+                continue
+            # Italic: *text* -> _text_; a * followed by a space is a bullet.
+            if i + 1 < end and not text[i + 1].isspace():
+                close = line.find_italic_close(i + 1, end)
+                if close != -1:
+                    out.append('_')
+                    _convert_markdown(text, i + 1, close, out, line)
+                    out.append('_')
+                    i = close + 1
+                    continue
+
+        elif char == '~':
+            # Strikethrough: ~~text~~ -> ~text~
+            if text.startswith('~', i + 1, end):
+                close = line.find('~~', i + 2, end)
+                if close != -1:
+                    out.append('~')
+                    _convert_markdown(text, i + 2, close, out, line)
+                    out.append('~')
+                    i = close + 2
+                    continue
+
+        elif char == '`':
+            # Inline Code: `text` -> ```text```, contents are left as-is.
+            close = line.find('`', i + 1, end)
+            if close != -1:
+                out.append('```')
+                out.append(text[i + 1:close])
+                out.append('```')
+                i = close + 1
+                continue
+
+        elif char == '[':
+            # Links: [text](url) -> text (url)
+            label_end = line.find('](', i + 1, end)
+            if label_end != -1:
+                url_end = line.find(')', label_end + 2, end)
+                if url_end != -1:
+                    _convert_markdown(text, i + 1, label_end, out, line)
+                    out.append(' (')
+                    out.append(text[label_end + 2:url_end])
+                    out.append(')')
+                    i = url_end + 1
+                    continue
+
+        out.append(char)
+        i += 1
+
+
 def markdown_to_whatsapp(text: str) -> str:
     """
     Converts basic Markdown formatting to WhatsApp formatting.
@@ -20,34 +176,28 @@ def markdown_to_whatsapp(text: str) -> str:
     - Strikethrough: ~~text~~ -> ~text~
     - Inline Code: `text` -> ```text```
     
-    It assumes standard Markdown and does not handle nested or
-    already-formatted WhatsApp strings (e.g., it will convert
-    _italic_ to __italic__ if it's run twice, so apply it only once).
+    The text is converted in a single left-to-right pass. Formatting inside
+    links, bold and strikethrough is converted too; inline code and URLs are
+    copied verbatim.
+
+    It assumes standard Markdown and does not handle already-formatted
+    WhatsApp strings (e.g., it will convert _italic_ to __italic__ if it's
+    run twice, so apply it only once).
     """
-    
-    # 1. Convert Links: [text](url) -> text (url)
-    # This regex finds [any text] followed by (any URL)
-    # The (.*?) is a non-greedy match for the content.
-    text = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', text)
-    
-    # 2. Convert Bold: **text** -> *text*
-    # This must run before the italic conversion.
-    text = re.sub(r'\*\*(.*?)\*\*', r'*\1*', text)
-    
-    # 3. Convert Italic: *text* -> _text_
-    # This runs after bold to avoid matching the * from bold.
-    text = re.sub(r'\*(.*?)\*', r'_\1_', text)
-    
-    # 4. Convert Strikethrough: ~~text~~ -> ~text~
-    text = re.sub(r'~~(.*?)~~', r'~\1~', text)
-    
-    # 5. Convert Inline Code: `text` -> ```text```
-    # This regex handles single backticks.
-    text = re.sub(r'`(.*?)`', r'```\1```', text)
-    
-    return text
+    out: list[str] = []
+    start = 0
+    while True:
+        line_end = text.find('\n', start)
+        if line_end == -1:
+            line_end = len(text)
+        _convert_markdown(text, start, line_end, out, _LineScanner(text, line_end))
+        if line_end == len(text):
+            return "".join(out)
+        out.append('\n')
+        start = line_end + 1
+
 
-def split_message_for_whatsapp(text: str, max_length: int = 4000) -> list[str]:
+def split_message_for_whatsapp(text: str, max_length: int = WHATSAPP_MAX_MESSAGE_LENGTH) -> list[str]:
     """
     Splits a message into chunks suitable for WhatsApp's 4096 character limit.
     
@@ -67,37 +217,100 @@ def split_message_for_whatsapp(text: str, max_length: int = 4000) -> list[str]:
         return [text]
     
     chunks = []
-    remaining = text
+    start = 0
+    end = len(text)
     
-    while len(remaining) > max_length:
+    while end - start > max_length:
+        limit = start + max_length
         # Find the best split point
-        split_point = max_length
+        split_point = limit
         
         # Try to find a newline before max_length
-        newline_idx = remaining.rfind('\n', 0, max_length)
+        newline_idx = text.rfind('\n', start, limit)
         if newline_idx != -1:
             split_point = newline_idx + 1  # Include the newline
         else:
             # Try to find a period before max_length
-            period_idx = remaining.rfind('.', 0, max_length)
+            period_idx = text.rfind('.', start, limit)
             if period_idx != -1:
                 split_point = period_idx + 1  # Include the period
         
         # Extract the chunk
-        chunk = remaining[:split_point].strip()
+        chunk = text[start:split_point].strip()
         if chunk:
             chunks.append(chunk)
         
-        # Update remaining text
-        remaining = remaining[split_point:].strip()
+        # Strip the rest of the text by moving the bounds, not by copying
+        start = split_point
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        while start < end and text[start].isspace():
+            start += 1
     
     # Add any remaining text
-    if remaining:
-        chunks.append(remaining)
+    if start < end:
+        chunks.append(text[start:end])
     
     return chunks
 
 
+async def reply_markdown(msg: Message, text: str) -> None:
+    """Formats a Markdown reply for WhatsApp and sends it in as many messages as needed."""
+    formatted_message = markdown_to_whatsapp(text)
+    # Most replies fit in one message; skip the split and its list.
+    if len(formatted_message) <= WHATSAPP_MAX_MESSAGE_LENGTH:
+        await msg.reply_text(formatted_message)
+        return
+    for chunk in split_message_for_whatsapp(formatted_message):
+        await msg.reply_text(chunk)
+
+
+class ReplyPipeline:
+    """
+    Sends Markdown replies in order without making the caller wait for them.
+
+    Each send is chained behind the previous one, so WhatsApp receives the
+    messages in order while the caller keeps producing more. Leaving the
+    context waits for every pending send; an exception cancels them instead.
+    """
+
+    def __init__(self, msg: Message) -> None:
+        self._msg = msg
+        self._sends: list[asyncio.Task] = []
+
+    async def __aenter__(self) -> "ReplyPipeline":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if not self._sends:
+            return
+        if exc_type is not None:
+            for task in self._sends:
+                task.cancel()
+            await asyncio.gather(*self._sends, return_exceptions=True)
+            return
+        await self._sends[-1]
+
+    def send(self, text: str) -> None:
+        """
+        Queues text to be sent after everything queued before it.
+
+        Raises the error of an earlier send that has already failed, so the
+        caller stops producing replies that would never be delivered.
+        """
+        previous = self._sends[-1] if self._sends else None
+        if previous is not None and previous.done() and not previous.cancelled():
+            error = previous.exception()
+            if error is not None:
+                raise error
+        self._sends.append(asyncio.create_task(self._send_after(previous, text)))
+
+    async def _send_after(self, previous: asyncio.Task | None, text: str) -> None:
+        if previous is not None:
+            await previous
+        await reply_markdown(self._msg, text)
+
+
 def with_typing_indicator(func):
     """Decorator that shows typing indicator while the function executes."""
     @wraps(func)
@@ -106,9 +319,13 @@ def with_typing_indicator(func):
         async def typing_indicator_loop(msg: Message) -> None:
             """Continuously send typing action to keep indicator active."""
             try:
+                await asyncio.sleep(TYPING_INDICATOR_GRACE)
+                next_at = time.monotonic()
                 while True:
                     await msg.indicate_typing()
-                    await asyncio.sleep(25)
+                    # Schedule from the previous tick so request time doesn't add drift.
+                    next_at += TYPING_INDICATOR_INTERVAL
+                    await asyncio.sleep(max(0.0, next_at - time.monotonic()))
             except asyncio.CancelledError:
                 pass
             except Exception as e:
@@ -133,4 +350,59 @@ def with_typing_indicator(func):
             with suppress(asyncio.CancelledError):
                 await typing_indicator_task
     
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def with_read_receipt(func):
+    """Decorator that marks the message as read while the handler runs."""
+    @wraps(func)
+    async def wrapper(client, msg: Message, *args, **kwargs):
+        mark_as_read_task = asyncio.create_task(msg.mark_as_read())
+        try:
+            result = await func(client, msg, *args, **kwargs)
+        except BaseException:
+            # The handler's error takes precedence over a failed read receipt.
+            with suppress(Exception):
+                await mark_as_read_task
+            raise
+        # The reply has already been sent; a missing read receipt is not worth
+        # an error message to the user.
+        try:
+            await mark_as_read_task
+        except Exception as e:
+            logger.warning(f"Failed to mark message {msg.id} as read: {e}")
+        return result
+
+    return wrapper
+
+
+def with_user_serialization(func):
+    """
+    Decorator that handles one message at a time per user.
+
+    Messages from the same user wait for the one in flight, so follow-ups
+    still get an answer but never race the previous reply and conversation
+    update. Webhook redeliveries are already dropped by pywa
+    (skip_duplicate_updates), so every message that gets here is handled.
+    """
+    # Per-user lock and the number of messages holding or waiting for it.
+    locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    @wraps(func)
+    async def wrapper(client, msg: Message, *args, **kwargs):
+        wa_id = msg.from_user.wa_id
+        lock, users = locks.get(wa_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        locks[wa_id] = (lock, users + 1)
+        try:
+            async with lock:
+                return await func(client, msg, *args, **kwargs)
+        finally:
+            lock, users = locks[wa_id]
+            if users == 1:
+                del locks[wa_id]
+            else:
+                locks[wa_id] = (lock, users - 1)
+
+    return wrapper
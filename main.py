@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 import asyncio
-from contextlib import asynccontextmanager, suppress
-import datetime as dt
+from contextlib import aclosing, asynccontextmanager, suppress
 from functools import wraps
+import time
 from urllib.parse import urlparse
 
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from pywa.api import WhatsAppError
 from pywa_async import WhatsApp, filters
 from pywa_async.types import Message
@@ -17,15 +18,23 @@ from app.commands import HELP_COMMAND, HELP_COMMAND_RESPONSE, NEW_COMMAND, NEW_C
 from app.config import get_settings
 from app.database import db_manager, with_db_session
 from app.error_handlers import handle_whatsapp_error, logger, universal_error_handler, with_error_handling
-from app.models import User
-from app.utils import markdown_to_whatsapp, split_message_for_whatsapp, with_typing_indicator
+from app.users import UserWriter, get_or_create_user
+from app.utils import ReplyPipeline, with_read_receipt, with_typing_indicator, with_user_serialization
 
 
 settings = get_settings()
 parsed_webhook = urlparse(settings.webhook_url)
 WEBHOOK_PATH = parsed_webhook.path or "/webhook"
 
-SESSION_TIMEOUT = dt.timedelta(minutes=settings.session_timeout)
+SESSION_TIMEOUT_SECONDS = settings.session_timeout * 60
+# Buffered ASK71 text is sent once it grows past this size and a line break arrives.
+STREAM_FLUSH_THRESHOLD = 3500
+
+# Commands answered with a fixed reply; /new also resets state and is handled separately.
+_COMMAND_TABLE = {
+    START_COMMAND: START_COMMAND_RESPONSE,
+    HELP_COMMAND: HELP_COMMAND_RESPONSE,
+}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -35,14 +44,27 @@ async def lifespan(app: FastAPI):
         api_key=settings.ask_api_key,
         agent_id=settings.agent_id,
         api_url=settings.ask_api_base,
+        http2=settings.ask_http2,
+        max_connections=settings.ask_max_connections,
+        max_keepalive_connections=settings.ask_max_keepalive_connections,
+        keepalive_expiry=settings.ask_keepalive_expiry,
+    )
+    db_manager.init(
+        settings.database_url,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
     )
-    db_manager.init(settings.database_url)
+    app.state.user_writer = UserWriter()
+    app.state.user_writer.start()
     yield
     logger.info("Shutting down FastAPI proxy layer")
+    await app.state.user_writer.close()
     await db_manager.close()
     await app.state.ask_client.close()
 
-app = FastAPI(title="ASK WhatsApp Bot", lifespan=lifespan)
+app = FastAPI(title="ASK WhatsApp Bot", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 wa_client = WhatsApp(
     phone_id=settings.whatsapp_phone_id,
@@ -59,73 +81,101 @@ wa_client = WhatsApp(
 
 @wa_client.on_message(filters.text)
 @with_error_handling
+@with_user_serialization
+@with_read_receipt
 @with_typing_indicator
 @with_db_session
 async def handle_text_message(client: WhatsApp, msg: Message, db: AsyncSession) -> None:
-    now = dt.datetime.now(dt.timezone.utc)
+    now_ts = time.time()
     wa_id = msg.from_user.wa_id
     username = msg.from_user.name
     text = msg.text.strip()
-    await msg.mark_as_read()
     ask_client: ASK71Client = app.state.ask_client 
+    user_writer: UserWriter = app.state.user_writer
 
-    user = await db.get(User, wa_id)
+    user = await get_or_create_user(db, wa_id, username, now_ts)
 
-    if user is None:
-        user = User(
-            wa_id=wa_id,
-            username=username,
-            conversation_id=None,
-            last_interaction=now,
+    if user.created:
+        # Let both finish before raising, so the session is never rolled back
+        # while the commit is still running.
+        results = await asyncio.gather(
+            msg.reply_text(START_COMMAND_RESPONSE),
+            db.commit(),
+            return_exceptions=True,
         )
-        db.add(user)
-
-        await msg.reply_text(START_COMMAND_RESPONSE)
-        await db.commit()
-        return
-
-    lower_text = text.lower()
-    if lower_text == START_COMMAND:
-        await msg.reply_text(START_COMMAND_RESPONSE)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
         return
 
-    if lower_text == NEW_COMMAND:
-        user.conversation_id = None
-        user.last_interaction = now
-        user.username = username
-        await db.commit()
-        await msg.reply_text(NEW_COMMAND_RESPONSE)
-        return
-    if lower_text == HELP_COMMAND:
-        await msg.reply_text(HELP_COMMAND_RESPONSE)
-        return
+    # Later writes go through the user writer; release the connection before
+    # the ASK71 call instead of holding it for the whole stream.
+    await db.close()
+
+    # Only lowercase messages that can be commands.
+    if text.startswith("/"):
+        command = text.lower()
+        response = _COMMAND_TABLE.get(command)
+        if response is not None:
+            await msg.reply_text(response)
+            return
+
+        if command == NEW_COMMAND:
+            user_writer.submit(
+                wa_id,
+                username=username,
+                conversation_id=None,
+                last_interaction_ts=now_ts,
+            )
+            await msg.reply_text(NEW_COMMAND_RESPONSE)
+            return
 
     should_start_new = False
-    if user.last_interaction is None:
+    if user.last_interaction_ts is None:
         should_start_new = True
     else:
-        should_start_new = now - user.last_interaction > SESSION_TIMEOUT
+        should_start_new = now_ts - user.last_interaction_ts > SESSION_TIMEOUT_SECONDS
 
     conversation_id = None if should_start_new else user.conversation_id
 
-    # ASK API call
-    ask_response = await ask_client.send_query(
-        query=text,
-        conversation_id=conversation_id,
+    # ASK API call, replying in segments while the answer streams in.
+    # Markdown spans never cross a line break, so segments end on one.
+    metadata = {}
+    pending: list[str] = []
+    pending_length = 0
+    # Closing the stream explicitly releases the ASK71 connection as soon as
+    # the loop stops, including when a failed send ends it early.
+    async with ReplyPipeline(msg) as replies, aclosing(
+        ask_client.stream_query(query=text, conversation_id=conversation_id)
+    ) as stream:
+        async for kind, value in stream:
+            if kind == "meta":
+                metadata.update(value)
+                continue
+            if not value:
+                continue
+            pending.append(value)
+            pending_length += len(value)
+            if pending_length >= STREAM_FLUSH_THRESHOLD and "\n" in value:
+                segment = "".join(pending)
+                cut = segment.rfind("\n") + 1
+                replies.send(segment[:cut])
+                rest = segment[cut:]
+                pending = [rest] if rest else []
+                pending_length = len(rest)
+
+        remaining = "".join(pending)
+        if remaining.strip():
+            replies.send(remaining)
+
+    # Only remember the conversation once the user has received the answer.
+    user_writer.submit(
+        wa_id,
+        username=username,
+        conversation_id=metadata.get("conversation_id") or conversation_id,
+        last_interaction_ts=now_ts,
     )
 
-    # Split message if it exceeds WhatsApp's character limit
-    formatted_message = markdown_to_whatsapp(ask_response.message)
-    message_chunks = split_message_for_whatsapp(formatted_message)
-    
-    for chunk in message_chunks:
-        await msg.reply_text(chunk)
-
-    user.conversation_id = ask_response.conversation_id
-    user.last_interaction = now
-    user.username = username
-    await db.commit()
-
 
 
 @app.get("/health")
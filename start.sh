@@ -2,4 +2,4 @@
 # Run database migrations
 uv run alembic upgrade head
 # Start the bot
-uv run uvicorn main:app --host 0.0.0.0 --port ${PORT:-8443}
\ No newline at end of file
+uv run uvicorn main:app --host 0.0.0.0 --port ${PORT:-8443} --loop uvloop --http httptools
\ No newline at end of file
@@ -0,0 +1,109 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app import users
+from app.users import UserWriter
+
+
+def stub_writes(writer: UserWriter) -> list[list[dict[str, Any]]]:
+    batches: list[list[dict[str, Any]]] = []
+
+    async def write(batch: list[dict[str, Any]]) -> None:
+        batches.append(batch)
+
+    writer._write = write
+    return batches
+
+
+def submit(writer: UserWriter, wa_id: str, conversation_id: str | None = None, ts: float = 0.0) -> None:
+    writer.submit(wa_id, username="User", conversation_id=conversation_id, last_interaction_ts=ts)
+
+
+def test_user_writer_batches_until_deadline() -> None:
+    writer = UserWriter(flush_interval=0.2)
+    batches = stub_writes(writer)
+
+    async def run() -> None:
+        writer.start()
+        for i in range(3):
+            submit(writer, f"u{i}")
+            await asyncio.sleep(0.01)
+        # Past the deadline, so the next update starts a new batch.
+        await asyncio.sleep(0.3)
+        submit(writer, "u3")
+        await writer.close()
+
+    asyncio.run(run())
+    assert [[row["wa_id"] for row in batch] for batch in batches] == [["u0", "u1", "u2"], ["u3"]]
+
+
+def test_user_writer_limits_batch_size() -> None:
+    writer = UserWriter(batch_size=2, flush_interval=10)
+    batches = stub_writes(writer)
+
+    async def run() -> None:
+        for i in range(5):
+            submit(writer, f"u{i}")
+        writer.start()
+        await writer.close()
+
+    asyncio.run(run())
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_user_writer_close_flushes_without_waiting() -> None:
+    writer = UserWriter(flush_interval=10)
+    batches = stub_writes(writer)
+
+    async def run() -> None:
+        writer.start()
+        submit(writer, "u0")
+        submit(writer, "u1")
+        await asyncio.wait_for(writer.close(), timeout=1)
+
+    asyncio.run(run())
+    assert [[row["wa_id"] for row in batch] for batch in batches] == [["u0", "u1"]]
+
+
+def test_user_writer_submit_updates_cache() -> None:
+    writer = UserWriter()
+    stub_writes(writer)
+    submit(writer, "cached", conversation_id="conv-1", ts=123.0)
+    assert users._user_cache["cached"] == users.UserState("conv-1", 123.0, created=False)
+
+
+def test_user_writer_write_keeps_latest_update_per_user(monkeypatch: pytest.MonkeyPatch) -> None:
+    statements = []
+
+    class FakeSession:
+        async def execute(self, stmt) -> None:
+            statements.append(stmt)
+
+        async def commit(self) -> None:
+            pass
+
+    class FakeManager:
+        @asynccontextmanager
+        async def session(self):
+            yield FakeSession()
+
+    monkeypatch.setattr(users, "db_manager", FakeManager())
+    batch = [
+        {"wa_id": "u0", "username": "User", "conversation_id": "old", "last_interaction": 1.0},
+        {"wa_id": "u1", "username": "User", "conversation_id": "other", "last_interaction": 1.0},
+        {"wa_id": "u0", "username": "User", "conversation_id": "new", "last_interaction": 2.0},
+    ]
+    asyncio.run(UserWriter()._write(batch))
+
+    (stmt,) = statements
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    rows = {
+        params[f"wa_id_m{i}"]: params[f"conversation_id_m{i}"]
+        for i in range(len(batch))
+        if f"wa_id_m{i}" in params
+    }
+    assert rows == {"u0": "new", "u1": "other"}
@@ -0,0 +1,208 @@
+import asyncio
+import inspect
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import ReplyPipeline, markdown_to_whatsapp, split_message_for_whatsapp, with_user_serialization
+
+MARKDOWN_CASES = [
+    # Basic conversions
+    ("**bold**", "*bold*"),
+    ("*italic*", "_italic_"),
+    ("~~strike~~", "~strike~"),
+    ("`code`", "```code```"),
+    ("see [docs](https://example.com) now", "see docs (https://example.com) now"),
+    ("1. *item*: ~~old~~ `new`", "1. _item_: ~old~ ```new```"),
+    # Inline code and URLs are copied verbatim
+    ("`a *b* ~~c~~`", "```a *b* ~~c~~```"),
+    ("[docs](https://example.com/a_b*c*)", "docs (https://example.com/a_b*c*)"),
+    # Formatting inside link labels, bold and strikethrough is converted
+    ("[**bold** link](https://example.com)", "*bold* link (https://example.com)"),
+    ("**a *b* c**", "*a _b_ c*"),
+    ("~~a **b**~~", "~a *b*~"),
+    # Nested and combined emphasis
+    ("***x***", "*_x_*"),
+    ("*a **b** c*", "_a *b* c_"),
+    # Bullets and unmatched delimiters are left alone
+    ("* item\n* item *x*", "* item\n* item _x_"),
+    ("2 * 3 * 4", "2 * 3 * 4"),
+    ("**unclosed", "**unclosed"),
+    ("a ~ b ~~c", "a ~ b ~~c"),
+    ("[a] (b) [c](d", "[a] (b) [c](d"),
+    # Spans never cross a line break
+    ("*open\nclose*", "*open\nclose*"),
+    ("**open\nclose**", "**open\nclose**"),
+    ("", ""),
+    ("plain text " * 50, "plain text " * 50),
+]
+
+
+@pytest.mark.parametrize(("markdown", "expected"), MARKDOWN_CASES)
+def test_markdown_to_whatsapp(markdown: str, expected: str) -> None:
+    assert markdown_to_whatsapp(markdown) == expected
+
+
+@pytest.mark.parametrize(("markdown", "expected"), MARKDOWN_CASES)
+def test_markdown_to_whatsapp_by_line(markdown: str, expected: str) -> None:
+    # Streamed replies are converted in segments that end on a line break.
+    segments = markdown.splitlines(keepends=True)
+    assert "".join(markdown_to_whatsapp(segment) for segment in segments) == expected
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "*a *b " * 7500,
+        "rm *.txt *.log " * 3000,
+        "[" * 45000,
+        "[a](b " * 7500,
+    ],
+    ids=["italic", "globs", "brackets", "links"],
+)
+def test_markdown_to_whatsapp_unmatched_delimiters_are_linear(line: str) -> None:
+    # Every opener on these lines is unmatched; rescanning the rest of the
+    # line for each one takes tens of seconds on a 45 KB line.
+    started = time.perf_counter()
+    assert markdown_to_whatsapp(line) == line
+    assert time.perf_counter() - started < 1
+
+
+@pytest.mark.parametrize(
+    ("text", "max_length", "expected"),
+    [
+        # Short text is returned as-is
+        ("  short  ", 10, ["  short  "]),
+        ("x" * 10, 10, ["x" * 10]),
+        # Split after the last newline, then the last period, then hard
+        ("aaaa\nbbbb\ncc", 10, ["aaaa\nbbbb", "cc"]),
+        ("a. b\ncccccc", 8, ["a. b", "cccccc"]),
+        ("aaaa. bbbb. cccc", 10, ["aaaa.", "bbbb. cccc"]),
+        ("one two.three\nfour", 10, ["one two.", "three\nfour"]),
+        ("a" * 25, 10, ["a" * 10, "a" * 10, "a" * 5]),
+        # Whitespace around chunks is stripped
+        ("  lead and trail  ", 10, ["lead and", "trail"]),
+        ("aaaa\n\n\n   bbbbbbbb  \n", 8, ["aaaa", "bbbbbbbb"]),
+    ],
+)
+def test_split_message_for_whatsapp(text: str, max_length: int, expected: list[str]) -> None:
+    assert split_message_for_whatsapp(text, max_length) == expected
+
+
+class FakeMessage:
+    """Records replies; later replies finish sooner to expose reordering."""
+
+    def __init__(self, fail_on: str | None = None) -> None:
+        self.fail_on = fail_on
+        self.sent: list[str] = []
+        self.started: list[str] = []
+
+    async def reply_text(self, text: str) -> None:
+        self.started.append(text)
+        await asyncio.sleep(0.01 / len(self.started))
+        if text == self.fail_on:
+            raise RuntimeError(f"failed to send {text}")
+        self.sent.append(text)
+
+
+def test_reply_pipeline_sends_in_order() -> None:
+    msg = FakeMessage()
+
+    async def run() -> None:
+        async with ReplyPipeline(msg) as replies:
+            for i in range(5):
+                replies.send(f"**{i}**")
+            # Sending happens in the background.
+            assert msg.sent == []
+
+    asyncio.run(run())
+    assert msg.sent == ["*0*", "*1*", "*2*", "*3*", "*4*"]
+
+
+def test_reply_pipeline_send_raises_earlier_failure() -> None:
+    msg = FakeMessage(fail_on="a")
+
+    async def run() -> None:
+        async with ReplyPipeline(msg) as replies:
+            replies.send("a")
+            await asyncio.sleep(0.05)
+            with pytest.raises(RuntimeError, match="failed to send a"):
+                replies.send("b")
+
+    with pytest.raises(RuntimeError, match="failed to send a"):
+        asyncio.run(run())
+    assert msg.started == ["a"]
+
+
+def test_reply_pipeline_exit_raises_failed_send() -> None:
+    msg = FakeMessage(fail_on="b")
+
+    async def run() -> None:
+        async with ReplyPipeline(msg) as replies:
+            for text in ("a", "b", "c"):
+                replies.send(text)
+
+    with pytest.raises(RuntimeError, match="failed to send b"):
+        asyncio.run(run())
+    assert msg.sent == ["a"]
+
+
+def test_reply_pipeline_cancels_pending_sends_on_error() -> None:
+    msg = FakeMessage()
+
+    async def run() -> None:
+        with pytest.raises(ValueError):
+            async with ReplyPipeline(msg) as replies:
+                for text in ("a", "b", "c"):
+                    replies.send(text)
+                await asyncio.sleep(0)
+                raise ValueError("stream failed")
+        # Nothing is left running to send after the error.
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert msg.started == ["a"]
+    assert msg.sent == []
+
+
+def test_user_serialization_orders_messages_per_user() -> None:
+    events: list[tuple[str, str]] = []
+
+    @with_user_serialization
+    async def handle(client, msg) -> None:
+        events.append(("start", msg.id))
+        await asyncio.sleep(0.01)
+        events.append(("end", msg.id))
+
+    def message(id: str, wa_id: str) -> SimpleNamespace:
+        return SimpleNamespace(id=id, from_user=SimpleNamespace(wa_id=wa_id))
+
+    async def run() -> None:
+        await asyncio.gather(*(
+            handle(None, message(id, wa_id))
+            for id, wa_id in [("a1", "a"), ("a2", "a"), ("b1", "b"), ("a3", "a")]
+        ))
+
+    asyncio.run(run())
+    user_a = [event for event in events if event[1].startswith("a")]
+    assert user_a == [
+        ("start", "a1"), ("end", "a1"),
+        ("start", "a2"), ("end", "a2"),
+        ("start", "a3"), ("end", "a3"),
+    ]
+    # Other users are not held up by user a.
+    assert events.index(("start", "b1")) < events.index(("end", "a1"))
+    assert inspect.getclosurevars(handle).nonlocals["locks"] == {}
+
+
+def test_user_serialization_releases_lock_on_error() -> None:
+    @with_user_serialization
+    async def handle(client, msg) -> None:
+        raise RuntimeError("handler failed")
+
+    msg = SimpleNamespace(id="m1", from_user=SimpleNamespace(wa_id="a"))
+    with pytest.raises(RuntimeError):
+        asyncio.run(handle(None, msg))
+    assert inspect.getclosurevars(handle).nonlocals["locks"] == {}